@@ -0,0 +1,112 @@
+# calendar_sync.py
+# Sincronização dos eventos do Google Calendar com o cache local, usada pelo main.py e pelo dashboard.py
+import os
+import json
+import datetime as dt
+from concurrent.futures import ThreadPoolExecutor
+
+# Libs do Google
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+
+# Número máximo de agendas consultadas em paralelo
+MAX_WORKERS = 10
+# Eventos por página (máximo aceito pela API) e campos retornados de cada evento
+EVENTS_PAGE_SIZE = 2500
+EVENT_FIELDS = 'items(id,status,created,end,attendees(email,self,resource)),nextPageToken,nextSyncToken'
+# Cache local dos eventos, atualizado de forma incremental com o syncToken de cada agenda
+EVENTS_CACHE_FILE = os.path.join('cache', 'events.json')
+
+def load_events_cache():
+    """Lê o cache local de eventos: {calendar_id: {'sync_token': ..., 'fields': ..., 'events': {event_id: evento}}}.
+
+    Um arquivo ausente, ilegível ou corrompido (por exemplo, de uma execução interrompida)
+    é tratado como cache vazio, o que leva a uma sincronização completa.
+    """
+    try:
+        with open(EVENTS_CACHE_FILE) as cache_file:
+            return json.load(cache_file)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def save_events_cache(cache):
+    """Grava o cache local de eventos de forma atômica (arquivo temporário + os.replace)."""
+    os.makedirs(os.path.dirname(EVENTS_CACHE_FILE), exist_ok=True)
+    temp_file = EVENTS_CACHE_FILE + '.tmp'
+    with open(temp_file, 'w') as cache_file:
+        json.dump(cache, cache_file)
+    os.replace(temp_file, EVENTS_CACHE_FILE)
+
+def list_all_pages(service, **params):
+    """Percorre todas as páginas de events().list e retorna (eventos, nextSyncToken)."""
+    events = []
+    page_token = None
+    while True:
+        events_result = service.events().list(
+            maxResults=EVENTS_PAGE_SIZE,
+            pageToken=page_token,
+            fields=EVENT_FIELDS,
+            **params
+        ).execute()
+        events.extend(events_result.get('items', []))
+
+        page_token = events_result.get('nextPageToken')
+        if not page_token:
+            return events, events_result.get('nextSyncToken')
+
+def ended_before(event, window_start):
+    """Indica se o evento terminou antes do início da janela (eventos de dia inteiro só têm a data)."""
+    end = event.get('end', {})
+    if 'dateTime' in end:
+        return dt.datetime.fromisoformat(end['dateTime'].replace('Z', '+00:00')) < window_start
+    if 'date' in end:
+        return dt.datetime.fromisoformat(end['date']).replace(tzinfo=dt.timezone.utc) < window_start
+    return False
+
+def fetch_calendar_events(creds, calendar_id, time_min, cached=None):
+    """Sincroniza os eventos de uma única agenda (executada em paralelo, uma agenda por thread).
+
+    Com um syncToken salvo, busca apenas os eventos alterados desde a última execução;
+    sem ele (ou se o Google invalidar o token), refaz a busca completa a partir de time_min.
+    Em ambos os casos, os eventos que terminaram antes de time_min são descartados.
+    Retorna o estado atualizado da agenda, no mesmo formato do cache.
+    """
+    # O httplib2 não é thread-safe, então cada thread monta o seu próprio service
+    service = build('calendar', 'v3', credentials=creds, cache_discovery=False)
+
+    events = None
+    # Um cache gravado com outros campos (por exemplo, sem 'end') exige a sincronização completa
+    if cached and cached.get('sync_token') and cached.get('fields') == EVENT_FIELDS:
+        try:
+            changes, sync_token = list_all_pages(service, calendarId=calendar_id, syncToken=cached['sync_token'], singleEvents=True)
+            events = dict(cached['events'])
+            for event in changes:
+                # Eventos removidos voltam com status 'cancelled'
+                if event.get('status') == 'cancelled':
+                    events.pop(event['id'], None)
+                else:
+                    events[event['id']] = event
+        except HttpError as error:
+            # 410 GONE: o token expirou e é preciso refazer a sincronização completa
+            if error.resp.status != 410:
+                raise
+
+    if events is None:
+        items, sync_token = list_all_pages(service, calendarId=calendar_id, timeMin=time_min, singleEvents=True, showDeleted=False)
+        events = {event['id']: event for event in items if event.get('status') != 'cancelled'}
+
+    # A sincronização incremental traz alterações de qualquer data, então o cache é recortado
+    # novamente para a janela, o que também descarta os eventos que já saíram dela
+    window_start = dt.datetime.fromisoformat(time_min)
+    events = {event_id: event for event_id, event in events.items() if not ended_before(event, window_start)}
+    return {'sync_token': sync_token, 'fields': EVENT_FIELDS, 'events': events}
+
+def sync_calendars(creds, calendar_ids, time_min):
+    """Sincroniza todas as agendas em paralelo a partir do cache local, grava o cache e devolve a lista de eventos."""
+    cache = load_events_cache()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        synced = executor.map(lambda calendar_id: fetch_calendar_events(creds, calendar_id, time_min, cache.get(calendar_id)), calendar_ids)
+        cache = dict(zip(calendar_ids, synced))
+    save_events_cache(cache)
+
+    return [event for calendar_cache in cache.values() for event in calendar_cache['events'].values()]
@@ -0,0 +1,35 @@
+# clients.py
+# Conexões compartilhadas pelo main.py e pelo dashboard.py
+import os
+import functools
+from supabase import create_client, Client
+
+# Libs do Google
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from google_auth_oauthlib.flow import InstalledAppFlow
+
+# Google Calendar API
+# Se modificar esses escopos, delete o arquivo token.json.
+SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
+
+@functools.lru_cache(maxsize=1)
+def supabase_client() -> Client:
+    """Cria o cliente do Supabase na primeira chamada e reaproveita o mesmo objeto nas seguintes."""
+    return create_client(os.environ['SUPABASE_URL'], os.environ['SUPABASE_KEY'])
+
+def get_credentials():
+    """Carrega as credenciais do Google do token.json, renovando ou pedindo autorização quando necessário."""
+    creds = None
+    if os.path.exists('token.json'):
+        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
+
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())
+        else:
+            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
+            creds = flow.run_local_server(port=0)
+        with open('token.json', 'w') as token:
+            token.write(creds.to_json())
+    return creds
@@ -1,71 +1,75 @@
 # dashboard.py
-import os
 import datetime as dt
+import numpy as np
 import pandas as pd
-from supabase import create_client, Client
+import pyarrow as pa
 import streamlit as st
+from clients import get_credentials, supabase_client
+from calendar_sync import sync_calendars
 
 # Libs do Google
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 
 # --- CONFIGURAÇÃO ---
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
+LEADS_CHUNK_SIZE = 200 # E-mails por requisição no filtro de leads
+LEADS_PAGE_SIZE = 1000 # Linhas por página (limite padrão do PostgREST)
+
+# --- CLIENTES (criados uma única vez e reaproveitados entre as execuções do Streamlit) ---
+@st.cache_resource
+def get_calendar_service():
+    """Carrega as credenciais do Google e monta o service do Calendar. Retorna (service, creds)."""
+    creds = get_credentials()
+    return build('calendar', 'v3', credentials=creds, cache_discovery=False), creds
 
 # --- FUNÇÕES DE BUSCA DE DADOS (as mesmas de antes) ---
-# Usamos o cache do Streamlit para não buscar os dados toda hora
-@st.cache_data(ttl=3600) # Armazena o resultado por 1 hora
-def get_supabase_leads():
-    """Busca os leads e suas datas de criação no Supabase."""
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Usamos o cache do Streamlit para não buscar os dados toda hora.
+# cache_resource devolve o próprio DataFrame (sem serializar a cada leitura), então ele não deve ser alterado.
+@st.cache_resource(ttl=3600) # Armazena o resultado por 1 hora
+def get_supabase_leads(emails):
+    """Busca no Supabase apenas os leads cujos e-mails aparecem nos eventos."""
+    supabase = supabase_client()
     try:
-        response = supabase.table('leads_data').select('email, created_at').execute()
-        df_leads = pd.DataFrame(response.data)
-        df_leads['created_at'] = pd.to_datetime(df_leads['created_at']).dt.tz_localize(None)
+        frames = []
+        for start in range(0, len(emails), LEADS_CHUNK_SIZE): # O filtro vai na URL, então enviamos em blocos
+            offset = 0
+            while True: # E cada bloco é lido página a página, pois o PostgREST limita as linhas por resposta
+                response = supabase.table('leads_data').select('email, created_at').in_('email', emails[start:start + LEADS_CHUNK_SIZE]).order('email').order('created_at').range(offset, offset + LEADS_PAGE_SIZE - 1).execute()
+                if response.data:
+                    frames.append(pd.DataFrame(response.data))
+                if len(response.data) < LEADS_PAGE_SIZE:
+                    break
+                offset += LEADS_PAGE_SIZE
+        if not frames:
+            return pd.DataFrame()
+        df_leads = pd.concat(frames, ignore_index=True).convert_dtypes(dtype_backend='pyarrow') # Colunas em Arrow
+        df_leads['created_at'] = pd.to_datetime(df_leads['created_at'], utc=True, format='ISO8601').dt.tz_convert(None)
         return df_leads
     except Exception as e:
         st.error(f"Erro ao buscar dados do Supabase: {e}")
         return pd.DataFrame()
 
-@st.cache_data(ttl=3600)
+@st.cache_resource(ttl=3600)
 def get_google_calendar_events():
     """Busca eventos em TODAS as agendas."""
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
     try:
-        service = build('calendar', 'v3', credentials=creds)
+        service, creds = get_calendar_service()
         calendar_list_result = service.calendarList().list().execute()
         calendars = calendar_list_result.get('items', [])
-        all_events = []
-        for calendar in calendars:
-            calendar_id = calendar['id']
-            time_min = (dt.datetime.now() - dt.timedelta(days=90)).isoformat() + 'Z'
-            events_result = service.events().list(calendarId=calendar_id, timeMin=time_min, maxResults=500, singleEvents=True, orderBy='startTime').execute()
-            all_events.extend(events_result.get('items', []))
+        calendar_ids = [calendar['id'] for calendar in calendars]
+        time_min = (dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=90)).isoformat() # Últimos 90 dias
+        all_events = sync_calendars(creds, calendar_ids, time_min) # Sincroniza a partir do cache local
         
-        processed_events = []
+        # Buffers pré-alocados com o total de convidados, preenchidos em uma única passada
+        emails = np.empty(sum(len(event.get('attendees', [])) for event in all_events), dtype=object)
+        created = np.empty(len(emails), dtype=object)
+        i = 0
         for event in all_events:
             if event.get('created') and event.get('attendees'):
                 for attendee in event['attendees']:
                     if not attendee.get('self', False) and not attendee.get('resource', False):
-                        processed_events.append({'attendee_email': attendee.get('email'), 'event_created_at': event.get('created')})
-        
-        df_events = pd.DataFrame(processed_events)
-        df_events['event_created_at'] = pd.to_datetime(df_events['event_created_at']).dt.tz_localize(None)
+                        emails[i], created[i] = attendee.get('email'), event['created']
+                        i += 1
+        df_events = pd.DataFrame({'attendee_email': pd.array(emails[:i], dtype=pd.ArrowDtype(pa.string())), 'event_created_at': pd.to_datetime(created[:i], utc=True, format='ISO8601').tz_convert(None)})
         return df_events
     except Exception as e:
         st.error(f"Ocorreu um erro na API do Google Calendar: {e}")
@@ -79,54 +83,60 @@ st.markdown("Análise do tempo médio entre a criação de um lead e o agendamen
 
 if st.button("Analisar Dados Agora"):
     with st.spinner("Buscando dados do Supabase e Google Calendar... Isso pode levar um momento."):
-        df_leads = get_supabase_leads()
         df_events = get_google_calendar_events()
+        df_leads = get_supabase_leads(tuple(df_events['attendee_email'].dropna().unique())) if not df_events.empty else pd.DataFrame()
 
+    # Sem dados de um dos lados não há o que analisar: encerra antes de qualquer processamento
     if df_leads.empty or df_events.empty:
         st.warning("Não foram encontrados dados suficientes para a análise.")
-    else:
-        st.success("Dados carregados com sucesso!")
+        st.stop()
 
-        # --- Lógica de Negócio (a mesma de antes) ---
-        merged_df = pd.merge(df_leads, df_events, left_on='email', right_on='attendee_email', how='inner')
-        merged_df = merged_df.sort_values(by='event_created_at', ascending=True)
-        first_call_df = merged_df.drop_duplicates(subset='email', keep='first')
-        
-        if first_call_df.empty:
-            st.warning("Nenhum lead encontrado com um evento de call agendado.")
-        else:
-            first_call_df['speed'] = first_call_df['event_created_at'] - first_call_df['created_at']
-            first_call_df = first_call_df[first_call_df['speed'] >= pd.Timedelta(0)]
-            
-            if first_call_df.empty:
-                st.warning("Nenhum lead com agendamento válido foi encontrado.")
-            else:
-                average_speed = first_call_df['speed'].mean()
-                
-                # --- EXIBIÇÃO DOS RESULTADOS ---
-                st.header("Resultados Principais")
-                
-                total_seconds = average_speed.total_seconds()
-                days = int(total_seconds // 86400)
-                hours = int((total_seconds % 86400) // 3600)
-                
-                col1, col2 = st.columns(2)
-                col1.metric("Lead to Opportunity Speed", f"{days} dias e {hours} horas")
-                col2.metric("Total de Leads Convertidos", f"{len(first_call_df)} leads")
+    st.success("Dados carregados com sucesso!")
+
+    # --- Lógica de Negócio (a mesma de antes) ---
+    first_event = df_events.groupby('attendee_email', sort=False)['event_created_at'].min()
+    leads = df_leads.groupby('email', sort=False, as_index=False)['created_at'].min() # Um lead por email (criação mais antiga)
+    first_call_df = leads.assign(event_created_at=leads['email'].map(first_event)).dropna(subset=['event_created_at'])
+    
+    if first_call_df.empty:
+        st.warning("Nenhum lead encontrado com um evento de call agendado.")
+        st.stop()
+
+    speed = first_call_df['event_created_at'] - first_call_df['created_at']
+    valid = speed >= pd.Timedelta(0)
+    
+    if not valid.any():
+        st.warning("Nenhum lead com agendamento válido foi encontrado.")
+        st.stop()
+
+    # Filtra e seleciona as colunas em um único passo
+    first_call_df = first_call_df.loc[valid, ['email', 'created_at', 'event_created_at']].assign(speed=speed[valid])
+    average_speed = first_call_df['speed'].mean()
+    
+    # --- EXIBIÇÃO DOS RESULTADOS ---
+    st.header("Resultados Principais")
+    
+    total_seconds = average_speed.total_seconds()
+    days = int(total_seconds // 86400)
+    hours = int((total_seconds % 86400) // 3600)
+    
+    col1, col2 = st.columns(2)
+    col1.metric("Lead to Opportunity Speed", f"{days} dias e {hours} horas")
+    col2.metric("Total de Leads Convertidos", f"{len(first_call_df)} leads")
 
-                st.header("Detalhes dos Leads Convertidos")
-                st.markdown("A tabela abaixo é interativa. Você pode ordenar as colunas clicando no cabeçalho.")
-                
-                # Preparando DataFrame para exibição
-                display_df = first_call_df[['email', 'created_at', 'event_created_at', 'speed']].copy()
-                display_df.rename(columns={
-                    'email': 'E-mail do Lead',
-                    'created_at': 'Data de Criação do Lead',
-                    'event_created_at': 'Data do Agendamento da Call',
-                    'speed': 'Tempo de Conversão'
-                }, inplace=True)
-                
-                # Formatando a coluna de tempo para ficar mais legível
-                display_df['Tempo de Conversão'] = display_df['Tempo de Conversão'].apply(lambda x: f"{x.days} dias, {x.seconds//3600} horas")
-                
-                st.dataframe(display_df, use_container_width=True)
\ No newline at end of file
+    st.header("Detalhes dos Leads Convertidos")
+    st.markdown("A tabela abaixo é interativa. Você pode ordenar as colunas clicando no cabeçalho.")
+    
+    # Preparando DataFrame para exibição (first_call_df já é uma cópia com apenas as colunas exibidas)
+    display_df = first_call_df.rename(columns={
+        'email': 'E-mail do Lead',
+        'created_at': 'Data de Criação do Lead',
+        'event_created_at': 'Data do Agendamento da Call',
+        'speed': 'Tempo de Conversão'
+    })
+    
+    # Formatando a coluna de tempo para ficar mais legível
+    components = display_df['Tempo de Conversão'].dt.components
+    display_df['Tempo de Conversão'] = components['days'].astype('string') + ' dias, ' + components['hours'].astype('string') + ' horas'
+    
+    st.dataframe(display_df, use_container_width=True)
\ No newline at end of file
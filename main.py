@@ -1,13 +1,13 @@
-import os
 import datetime as dt
 from dotenv import load_dotenv
+import numba
+import numpy as np
 import pandas as pd
-from supabase import create_client, Client
+import pyarrow as pa
+from clients import get_credentials, supabase_client
+from calendar_sync import sync_calendars
 
 # Libs do Google
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
@@ -15,34 +15,63 @@ from googleapiclient.errors import HttpError
 load_dotenv()
 
 # --- CONFIGURAÇÃO ---
-# Supabase
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Supabase (as credenciais SUPABASE_URL e SUPABASE_KEY são lidas pelo clients.py)
+# Quantidade de e-mails enviados por requisição no filtro de leads
+LEADS_CHUNK_SIZE = 200
+# Linhas por página na leitura dos leads (limite padrão de linhas por resposta do PostgREST)
+LEADS_PAGE_SIZE = 1000
 
-# Google Calendar API
-# Se modificar esses escopos, delete o arquivo token.json.
-SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
+# Google Calendar API (paralelismo, campos e cache local ficam no calendar_sync.py)
 
 # --- FUNÇÕES ---
 
-def get_supabase_leads():
-    """Busca os leads e suas datas de criação no Supabase."""
+@numba.njit(cache=True, fastmath=True)
+def mean_positive_delta_ns(start_ns, end_ns):
+    """Média (em ns) das diferenças end - start não negativas. Retorna (média, quantidade)."""
+    total = 0.0
+    count = 0
+    for i in range(start_ns.size):
+        delta = end_ns[i] - start_ns[i]
+        if delta >= 0:
+            total += delta
+            count += 1
+    return (total / count if count else 0.0), count
+
+def get_supabase_leads(emails):
+    """Busca no Supabase os leads (e suas datas de criação) cujos e-mails aparecem nos eventos."""
     print("Buscando leads no Supabase...")
     try:
         # ATENÇÃO: Altere 'sua_tabela_leads' para o nome real da sua tabela.
         # Altere 'email' e 'created_at' para os nomes reais das suas colunas.
-        response = supabase.table('leads_data').select('email, created_at').execute()
+        supabase = supabase_client()
+        # O filtro .in_() vai na URL, então os e-mails são enviados em blocos
+        frames = []
+        for start in range(0, len(emails), LEADS_CHUNK_SIZE):
+            chunk = emails[start:start + LEADS_CHUNK_SIZE]
+
+            # O PostgREST limita as linhas de cada resposta, então cada bloco é lido página a página
+            offset = 0
+            while True:
+                response = (
+                    supabase.table('leads_data').select('email, created_at').in_('email', chunk)
+                    .order('email').order('created_at')
+                    .range(offset, offset + LEADS_PAGE_SIZE - 1)
+                    .execute()
+                )
+                if response.data:
+                    frames.append(pd.DataFrame(response.data))
+                if len(response.data) < LEADS_PAGE_SIZE:
+                    break
+                offset += LEADS_PAGE_SIZE
         
-        leads_data = response.data
-        if not leads_data:
+        if not frames:
             print("Nenhum lead encontrado no Supabase.")
             return pd.DataFrame()
 
-        # Converte para DataFrame do Pandas
-        df_leads = pd.DataFrame(leads_data)
-        # Converte a coluna de data para o formato datetime (removendo timezone para facilitar a comparação)
-        df_leads['created_at'] = pd.to_datetime(df_leads['created_at']).dt.tz_localize(None)
+        # Junta as páginas em um DataFrame do Pandas, com colunas em Arrow (strings em um buffer contíguo)
+        df_leads = pd.concat(frames, ignore_index=True).convert_dtypes(dtype_backend='pyarrow')
+        # Converte a coluna de data para datetime em UTC (sem timezone, para facilitar a comparação)
+        df_leads['created_at'] = pd.to_datetime(df_leads['created_at'], utc=True, format='ISO8601').dt.tz_convert(None)
         
         print(f"Encontrados {len(df_leads)} leads.")
         return df_leads
@@ -54,70 +83,55 @@ def get_supabase_leads():
 def get_google_calendar_events():
     """Busca eventos e suas datas de criação em TODAS as agendas do usuário."""
     print("Buscando eventos no Google Calendar...")
-    creds = None
-    if os.path.exists('token.json'):
-        creds = Credentials.from_authorized_user_file('token.json', SCOPES)
-    
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file('credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open('token.json', 'w') as token:
-            token.write(creds.to_json())
+    creds = get_credentials()
 
     try:
-        service = build('calendar', 'v3', credentials=creds)
+        service = build('calendar', 'v3', credentials=creds, cache_discovery=False)
 
         # 1. PEGAR A LISTA DE TODAS AS AGENDAS
         print("Buscando a lista de agendas disponíveis...")
         calendar_list_result = service.calendarList().list().execute()
         calendars = calendar_list_result.get('items', [])
         
-        all_events = [] # Lista para armazenar eventos de TODAS as agendas
-
-        # 2. FAZER UM LOOP EM CADA AGENDA PARA BUSCAR OS EVENTOS
+        # 2. BUSCAR OS EVENTOS DE TODAS AS AGENDAS EM PARALELO
+        calendar_ids = []
         for calendar in calendars:
-            calendar_id = calendar['id']
-            print(f"  -> Buscando eventos na agenda: {calendar.get('summary')} ({calendar_id})")
-
-            # Busca eventos dos últimos 90 dias (ajuste conforme necessário)
-            time_min = (dt.datetime.now() - dt.timedelta(days=90)).isoformat() + 'Z'
-
-            # A requisição de eventos agora é feita dentro do loop
-            events_result = service.events().list(
-                calendarId=calendar_id, 
-                timeMin=time_min,
-                maxResults=500, # Aumente se tiver muitos eventos
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
-            
-            events = events_result.get('items', [])
-            all_events.extend(events) # Adiciona os eventos encontrados à lista principal
+            print(f"  -> Buscando eventos na agenda: {calendar.get('summary')} ({calendar['id']})")
+            calendar_ids.append(calendar['id'])
+
+        # Busca eventos dos últimos 90 dias (ajuste conforme necessário)
+        time_min = (dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=90)).isoformat()
+
+        # Cada agenda é sincronizada a partir do que já está no cache local
+        all_events = sync_calendars(creds, calendar_ids, time_min) # Eventos de TODAS as agendas
 
         if not all_events:
             print("Nenhum evento encontrado em nenhuma das agendas.")
             return pd.DataFrame()
 
         # 3. PROCESSAR A LISTA UNIFICADA DE EVENTOS
-        processed_events = []
+        # Os buffers são pré-alocados com o total de convidados (limite superior) e preenchidos em uma única passada
+        total_attendees = sum(len(event.get('attendees', [])) for event in all_events)
+        emails = np.empty(total_attendees, dtype=object)
+        created = np.empty(total_attendees, dtype=object)
+        i = 0
         for event in all_events:
             creation_date = event.get('created')
             if not creation_date:
                 continue
             
-            attendees = event.get('attendees', [])
-            for attendee in attendees:
+            for attendee in event.get('attendees', []):
+                # Ignora o próprio usuário e recursos (salas, equipamentos)
                 if not attendee.get('self', False) and not attendee.get('resource', False):
-                    processed_events.append({
-                        'attendee_email': attendee.get('email'),
-                        'event_created_at': creation_date
-                    })
+                    emails[i] = attendee.get('email')
+                    created[i] = creation_date
+                    i += 1
         
-        df_events = pd.DataFrame(processed_events)
-        df_events['event_created_at'] = pd.to_datetime(df_events['event_created_at']).dt.tz_localize(None)
+        # Monta o DataFrame já com os tipos finais, sem inferência de tipos linha a linha
+        df_events = pd.DataFrame({
+            'attendee_email': pd.array(emails[:i], dtype=pd.ArrowDtype(pa.string())),
+            'event_created_at': pd.to_datetime(created[:i], utc=True, format='ISO8601').tz_convert(None)
+        })
 
         print(f"Encontrados {len(df_events)} registros de convidados em um total de {len(all_events)} eventos.")
         return df_events
@@ -128,42 +142,51 @@ def get_google_calendar_events():
 
 def main():
     """Função principal para orquestrar o processo."""
-    df_leads = get_supabase_leads()
     df_events = get_google_calendar_events()
+    if df_events.empty:
+        print("Não há dados suficientes para calcular a métrica. Encerrando.")
+        return
+
+    # Busca apenas os leads que aparecem como convidados em algum evento
+    emails = df_events['attendee_email'].dropna().unique().tolist()
+    df_leads = get_supabase_leads(emails)
 
-    if df_leads.empty or df_events.empty:
+    if df_leads.empty:
         print("Não há dados suficientes para calcular a métrica. Encerrando.")
         return
 
     # --- Lógica de Negócio ---
-    # 1. Unir os dados de leads com os de eventos usando o email como chave
-    merged_df = pd.merge(df_leads, df_events, left_on='email', right_on='attendee_email', how='inner')
+    # 1. Para cada convidado, pode haver múltiplos eventos. Queremos o PRIMEIRO.
+    # Agregamos pelo menor horário de criação, gerando uma Series indexada pelo email.
+    first_event = df_events.groupby('attendee_email', sort=False)['event_created_at'].min()
+
+    # 2. O mesmo email pode aparecer em mais de uma linha de lead; cada email conta como um lead só,
+    # com a data de criação mais antiga
+    df_leads = df_leads.groupby('email', sort=False, as_index=False)['created_at'].min()
 
-    # 2. Para cada lead, pode haver múltiplos eventos. Queremos o PRIMEIRO.
-    # Ordenamos por data de criação do evento e removemos duplicatas de leads, mantendo a primeira ocorrência.
-    merged_df = merged_df.sort_values(by='event_created_at', ascending=True)
-    first_call_df = merged_df.drop_duplicates(subset='email', keep='first')
+    # 3. Buscar o primeiro evento de cada lead pelo email (um lookup por lead, sem merge)
+    first_call_df = df_leads.assign(event_created_at=df_leads['email'].map(first_event))
+    first_call_df = first_call_df.dropna(subset=['event_created_at'])
 
     if first_call_df.empty:
         print("Nenhum lead encontrado com um evento de call agendado.")
         return
 
-    # 3. Calcular a diferença de tempo (Speed)
-    first_call_df['speed'] = first_call_df['event_created_at'] - first_call_df['created_at']
+    # 4. Calcular a diferença de tempo (Speed) e a sua média em uma única passada.
+    # Tempos negativos são ignorados (caso o evento tenha sido criado antes do lead, o que pode ser um erro de dados)
+    created_ns = first_call_df['created_at'].to_numpy(dtype='datetime64[ns]').view('i8')
+    event_ns = first_call_df['event_created_at'].to_numpy(dtype='datetime64[ns]').view('i8')
+    mean_ns, valid_leads = mean_positive_delta_ns(created_ns, event_ns)
     
-    # Ignorar tempos negativos (caso o evento tenha sido criado antes do lead, o que pode ser um erro de dados)
-    first_call_df = first_call_df[first_call_df['speed'] >= pd.Timedelta(0)]
-    
-    if first_call_df.empty:
+    if valid_leads == 0:
         print("Nenhum lead com agendamento válido (evento criado após o lead) foi encontrado.")
         return
 
-    # 4. Calcular a média
-    average_speed = first_call_df['speed'].mean()
+    average_speed = pd.Timedelta(int(mean_ns), unit='ns')
     
     # --- Apresentar o Resultado ---
     print("\n--- RESULTADO: Lead to Opportunity Speed ---")
-    print(f"Baseado em {len(first_call_df)} leads que tiveram uma call agendada.")
+    print(f"Baseado em {valid_leads} leads que tiveram uma call agendada.")
     
     # Convertendo o resultado (Timedelta) para um formato mais legível
     total_seconds = average_speed.total_seconds()